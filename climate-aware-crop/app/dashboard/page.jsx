@@ -213,7 +213,8 @@ export default function FarmerInputDashboard() {
           temperature: parseFloat(formData.temperature),
           rainfall: parseFloat(formData.rainfall),
           soil_moisture: parseFloat(formData.soil_moisture),
-          pest_damage: parseFloat(formData.pest_damage)
+          pest_damage: parseFloat(formData.pest_damage),
+          top_k: 0 // all features, for the detailed SHAP view
         })
       })
 
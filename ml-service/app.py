@@ -2,21 +2,64 @@
 FastAPI Application for Crop Stress Prediction
 """
 
-from fastapi import FastAPI
+import os
+
+# One OpenMP thread per process: throughput comes from running several uvicorn
+# workers. Must be set before numpy/xgboost start their thread pools.
+os.environ.setdefault("OMP_NUM_THREADS", "1")
+
+if __name__ == '__main__':
+    # Thin launcher: hand off to the uvicorn CLI before anything is loaded, so
+    # neither this process nor the workers' spawn bootstrap loads the model; each
+    # worker loads it once when importing `app`. The worker count is passed via
+    # WEB_CONCURRENCY (uvicorn's own default for --workers) so each worker can
+    # size its prediction pool to its share of the cores.
+    import subprocess
+    import sys
+    print("\n" + "="*50)
+    print("🌾 Crop Stress Classification API")
+    print("="*50)
+    print(f"📍 Server running at http://localhost:8001")
+    print("="*50 + "\n")
+    os.environ.setdefault("WEB_CONCURRENCY", str(os.cpu_count() or 1))
+    sys.exit(subprocess.call([
+        sys.executable, '-m', 'uvicorn', 'app:app',
+        '--host', '0.0.0.0',
+        '--port', '8001',
+        '--app-dir', os.path.dirname(os.path.abspath(__file__))
+    ]))
+
+from fastapi import Depends, FastAPI, Request, Response
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import ORJSONResponse
+import msgspec
+import orjson
 import pandas as pd
 import numpy as np
-import os
+import asyncio
 import json
+import mmap
+import re
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import List
+import xgboost as xgb
 from xgboost import XGBClassifier
 import shap
 
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None  # Optional: inference falls back to XGBoost
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Crop Stress Monitoring API",
     description="ML-powered crop stress prediction system for precision agriculture",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # Configure CORS
@@ -34,15 +77,58 @@ MODELS_DIR = os.path.join(BASE_DIR, 'models')
 MODEL_PATH = os.path.join(MODELS_DIR, 'crop_stress_model.json')
 TRAIN_DATA_PATH = os.path.join(MODELS_DIR, 'X_train.csv')
 FEATURES_PATH = os.path.join(MODELS_DIR, 'feature_columns.json')
+ONNX_MODEL_PATH = os.path.join(MODELS_DIR, 'crop_stress_model.onnx')
+
+def prefetch_file(path):
+    """Pull a file into the page cache so the parse that follows reads warm pages"""
+    try:
+        with open(path, 'rb') as f:
+            if hasattr(mmap, 'MAP_POPULATE'):
+                mm = mmap.mmap(
+                    f.fileno(), 0,
+                    flags=mmap.MAP_PRIVATE | mmap.MAP_POPULATE,
+                    prot=mmap.PROT_READ
+                )
+                mm.close()
+            else:
+                # No MAP_POPULATE (non-Linux): a sequential read warms the cache too
+                while f.read(1 << 20):
+                    pass
+    except Exception:
+        pass  # Load errors are reported by the real loaders below
+
+# Prefetch all model files in parallel while they are parsed one by one
+prefetch_paths = (MODEL_PATH, TRAIN_DATA_PATH, FEATURES_PATH, ONNX_MODEL_PATH)
+prefetch_pool = ThreadPoolExecutor(max_workers=len(prefetch_paths))
+for path in prefetch_paths:
+    prefetch_pool.submit(prefetch_file, path)
 
 # Load model
 try:
     best_model = XGBClassifier()
     best_model.load_model(MODEL_PATH)
+    best_model.set_params(n_jobs=1)
+    booster = best_model.get_booster()
     print("✅ Model loaded successfully")
 except Exception as e:
     print(f"❌ Error loading model: {e}")
     best_model = None
+    booster = None
+
+# Load ONNX Runtime session for inference (export with export_onnx.py); the
+# XGBoost model is still used for SHAP explanations
+onnx_session = None
+try:
+    if ort is not None and best_model is not None and os.path.exists(ONNX_MODEL_PATH):
+        session_options = ort.SessionOptions()
+        session_options.intra_op_num_threads = 1
+        session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        onnx_session = ort.InferenceSession(
+            ONNX_MODEL_PATH, sess_options=session_options, providers=["CPUExecutionProvider"]
+        )
+        print("✅ ONNX Runtime session loaded")
+except Exception as e:
+    print(f"⚠️  ONNX Runtime unavailable, using XGBoost for inference: {e}")
 
 # Load training data
 try:
@@ -61,18 +147,171 @@ except Exception as e:
     print(f"❌ Error loading features: {e}")
     X_cols = None
 
+prefetch_pool.shutdown(wait=False)
+
+# Precompute baseline (training means) once; it is static after load
+BASELINE_DICT = None
+BASELINE_ROW = None
+COL_INDEX = None
+SEASON_COLS = None
+CROP_COLS = None
+SEASON_LOOKUP = {}
+CROP_LOOKUP = {}
+SEASON_FALLBACK = {}
+CROP_FALLBACK = {}
+IDX_T2M = IDX_RF = IDX_SM = IDX_PD = None
+IDX_PDxSM = IDX_PDxTD = IDX_PHxRF = None
+TEMP_DEVIATION = PEST_HOTSPOTS = 0.0
+try:
+    if X_train is not None and X_cols is not None:
+        BASELINE_DICT = X_train.mean().to_dict()
+        BASELINE_ROW = np.ascontiguousarray([BASELINE_DICT[c] for c in X_cols], dtype=np.float32)
+        COL_INDEX = {c: i for i, c in enumerate(X_cols)}
+        
+        # Categorical one-hot positions and {user value -> column index} tables
+        SEASON_COLS = np.array([i for i, c in enumerate(X_cols) if c.startswith("Season_")], dtype=np.intp)
+        CROP_COLS = np.array([i for i, c in enumerate(X_cols) if c.startswith("Crop_Type_")], dtype=np.intp)
+        SEASON_LOOKUP = {c[len("Season_"):]: i for i, c in enumerate(X_cols) if c.startswith("Season_")}
+        CROP_LOOKUP = {c[len("Crop_Type_"):]: i for i, c in enumerate(X_cols) if c.startswith("Crop_Type_")}
+        
+        # Case-insensitive fallbacks for user values that don't match exactly
+        SEASON_FALLBACK = {value.lower(): i for value, i in SEASON_LOOKUP.items()}
+        CROP_FALLBACK = {value.lower(): i for value, i in CROP_LOOKUP.items()}
+        
+        # Positions of the user-supplied numerics and the interaction features
+        IDX_T2M = COL_INDEX['T2M']
+        IDX_RF = COL_INDEX['Rainfall']
+        IDX_SM = COL_INDEX['Soil_Moisture']
+        IDX_PD = COL_INDEX['Pest_Damage']
+        IDX_PDxSM = COL_INDEX['pest_damage_x_moisture']
+        IDX_PDxTD = COL_INDEX['pest_damage_x_temp_deviation']
+        IDX_PHxRF = COL_INDEX['pest_hotspots_x_rainfall']
+        
+        # Interaction partners that always stay at their baseline value
+        IDX_TD = COL_INDEX.get('temp_deviation_from_normal')
+        IDX_PH = COL_INDEX.get('Pest_Hotspots')
+        TEMP_DEVIATION = float(BASELINE_ROW[IDX_TD]) if IDX_TD is not None else 0.0
+        PEST_HOTSPOTS = float(BASELINE_ROW[IDX_PH]) if IDX_PH is not None else 0.0
+        print("✅ Baseline features computed")
+except Exception as e:
+    print(f"❌ Error computing baseline: {e}")
+
+# Only the baseline statistics are needed from here on; release the training frame
+del X_train
+
 # Stress mapping
 STRESS_MAP = {0: "Healthy", 1: "Moderate Stress", 2: "Severe Stress"}
 
-# Initialize SHAP Explainer (only if model and training data loaded)
+# Number of distinct quantized inputs kept in the prediction cache
+PREDICTION_CACHE_SIZE = 4096
+
+# Largest probability difference tolerated between the ONNX export and XGBoost
+ONNX_TOLERANCE = 1e-4
+
+# Maximum number of inputs accepted by /api/predict_batch
+MAX_BATCH_SIZE = 1000
+
+# Input validation ranges
+VALIDATION_RULES = {
+    'temperature': (-50, 60),
+    'rainfall': (0, 500),
+    'soil_moisture': (0, 100),
+    'pest_damage': (0, 100)
+}
+
+# Bounds as arrays for the vectorized check, ordered like VAL_NAMES
+VAL_NAMES = ('temperature', 'rainfall', 'soil_moisture', 'pest_damage')
+VAL_LO = np.array([VALIDATION_RULES[n][0] for n in VAL_NAMES], dtype=np.float64)
+VAL_HI = np.array([VALIDATION_RULES[n][1] for n in VAL_NAMES], dtype=np.float64)
+# Error messages built once from the same rules (display label, unit)
+VAL_LABELS = {
+    'temperature': ('Temperature', '°C'),
+    'rainfall': ('Rainfall', 'mm'),
+    'soil_moisture': ('Soil Moisture', '%'),
+    'pest_damage': ('Pest Damage', '%')
+}
+VAL_ERRORS = tuple(
+    f"{VAL_LABELS[n][0]} must be between {VALIDATION_RULES[n][0]} and {VALIDATION_RULES[n][1]}{VAL_LABELS[n][1]}"
+    for n in VAL_NAMES
+)
+
+# Initialize SHAP Explainer (only if model and baseline loaded). Tree SHAP on
+# XGBoost uses the trees' own cover statistics, so no background data is kept.
 shap_explainer = None
 try:
-    if best_model is not None and X_train is not None:
-        shap_explainer = shap.TreeExplainer(best_model)
+    if best_model is not None and BASELINE_ROW is not None:
+        shap_explainer = shap.TreeExplainer(best_model, feature_perturbation="tree_path_dependent")
         print("✅ SHAP Explainer initialized")
 except Exception as e:
     print(f"⚠️  SHAP Explainer initialization failed: {e}")
 
+# Use XGBoost's GPU TreeSHAP (pred_contribs) when a GPU is visible. It runs on a
+# separate booster copy so prediction keeps using the CPU booster and NumPy input
+# without XGBoost's device-mismatch fallback.
+USE_GPU_SHAP = False
+shap_booster = None
+try:
+    if booster is not None and X_cols is not None and xgb.build_info().get('USE_CUDA'):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            gpu_booster = booster.copy()
+            gpu_booster.set_param({'device': 'cuda'})
+            config = json.loads(gpu_booster.save_config())
+        if config['learner']['generic_param']['device'].startswith('cuda'):
+            shap_booster = gpu_booster
+            USE_GPU_SHAP = True
+            print("✅ GPU TreeSHAP enabled")
+except Exception as e:
+    print(f"⚠️  GPU TreeSHAP unavailable: {e}")
+
+def compute_shap_values(data):
+    """Return SHAP values for a feature matrix as an array of (classes, rows, features)"""
+    if USE_GPU_SHAP:
+        # XGBoost's built-in GPU TreeSHAP: (rows, classes, features + bias)
+        contribs = shap_booster.predict(
+            xgb.DMatrix(data, feature_names=X_cols), pred_contribs=True
+        )
+        return np.moveaxis(contribs[:, :, :-1], 1, 0)
+    return np.array(shap_explainer.shap_values(data))
+
+def compute_approx_contribs(data):
+    """Return XGBoost's fast approximate contributions as (classes, rows, features).
+
+    These are Saabas-style per-path attributions: one tree traversal per row and
+    usually the same sign as SHAP for the dominant features, but not exact.
+    """
+    contribs = booster.predict(
+        xgb.DMatrix(data, feature_names=X_cols), pred_contribs=True, approx_contribs=True
+    )
+    return np.moveaxis(contribs[:, :, :-1], 1, 0)
+
+# Bounded pool for model + SHAP work sized to this worker's share of the cores
+# (WEB_CONCURRENCY workers in total). Each prediction runs single-threaded
+# inside XGBoost, so workers x threads never exceeds the core count.
+PREDICTION_THREADS = max(1, (os.cpu_count() or 1) // max(1, int(os.environ.get("WEB_CONCURRENCY", "1"))))
+prediction_pool = ThreadPoolExecutor(max_workers=PREDICTION_THREADS)
+
+# Make sure the ONNX export still matches crop_stress_model.json: a stale export
+# would serve the old model's probabilities while SHAP explains the new one
+try:
+    if onnx_session is not None:
+        if BASELINE_ROW is None:
+            raise ValueError("no baseline row to verify against")
+        probes = np.repeat(BASELINE_ROW.reshape(1, -1), 1 + len(SEASON_COLS) + len(CROP_COLS), axis=0)
+        for probe, idx in zip(probes[1:], np.concatenate([SEASON_COLS, CROP_COLS])):
+            probe[idx] = 1 - probe[idx]
+        onnx_proba = onnx_session.run(["probabilities"], {"input": probes})[0]
+        xgb_proba = booster.inplace_predict(probes)
+        if not np.allclose(onnx_proba, xgb_proba, atol=ONNX_TOLERANCE):
+            raise ValueError(
+                f"max probability difference {np.abs(onnx_proba - xgb_proba).max():.2e}; "
+                "re-run export_onnx.py"
+            )
+        print("✅ ONNX model matches XGBoost model")
+except Exception as e:
+    print(f"⚠️  ONNX model disabled, using XGBoost for inference: {e}")
+    onnx_session = None
+
 # Friendly feature names for farmers
 FEATURE_NAMES_FRIENDLY = {
     'T2M': '🌡️ Temperature (°C)',
@@ -105,177 +344,387 @@ FEATURE_NAMES_FRIENDLY = {
     'pest_hotspots_x_rainfall': '🔗 Pest Hotspots × Rainfall',
 }
 
+# Friendly names aligned to X_cols, indexed by feature position
+FRIENDLY_ARR = None
+if X_cols is not None:
+    FRIENDLY_ARR = np.array([FEATURE_NAMES_FRIENDLY.get(c, c) for c in X_cols], dtype=object)
+
 # Request model
-class PredictionRequest(BaseModel):
+class PredictionRequest(msgspec.Struct):
     season: str
     crop_type: str
     temperature: float
     rainfall: float
     soil_moisture: float
     pest_damage: float
+    explain: bool = True  # False trades exact SHAP values for a faster approximation
+    top_k: int = 3  # 0 returns every feature
+
+def decode_body(body, body_type):
+    """Decode JSON with msgspec, coercing numeric strings like Pydantic used to.
+
+    Errors are raised as RequestValidationError so clients keep FastAPI's
+    422 body: {"detail": [{"loc": [...], "msg": ..., "type": ...}]}.
+    """
+    try:
+        return msgspec.json.decode(body, type=body_type, strict=False)
+    except msgspec.ValidationError as e:
+        msg, _, path = str(e).partition(' - at `$')
+        loc = ['body'] + [
+            int(index) if index else key
+            for key, index in re.findall(r"\.(\w+)|\[(\d+)\]", path.rstrip('`'))
+        ]
+        raise RequestValidationError([{'loc': loc, 'msg': msg, 'type': 'value_error'}])
+    except msgspec.DecodeError as e:
+        raise RequestValidationError([{'loc': ['body'], 'msg': str(e), 'type': 'json_invalid'}])
+
+async def parse_prediction_request(request: Request) -> PredictionRequest:
+    """Decode the request body straight into a PredictionRequest with msgspec"""
+    return decode_body(await request.body(), PredictionRequest)
+
+async def parse_prediction_batch(request: Request) -> List[PredictionRequest]:
+    """Decode a JSON array of prediction requests with msgspec"""
+    return decode_body(await request.body(), List[PredictionRequest])
+
+# Request-body schemas for /openapi.json, since the body bypasses FastAPI's parsing
+PREDICTION_REQUEST_SCHEMA = msgspec.json.schema(PredictionRequest)['$defs']['PredictionRequest']
+
+def request_body_openapi(schema):
+    """openapi_extra entry documenting a JSON request body"""
+    return {'requestBody': {'required': True, 'content': {'application/json': {'schema': schema}}}}
+
+def json_response(content):
+    """Encode a response with orjson (NumPy scalars included), bypassing FastAPI's encoder"""
+    return Response(
+        content=orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY),
+        media_type="application/json"
+    )
+
+def fill_feature_row(row, user_season, user_crop, user_temp, user_rainfall, user_moisture, user_pest_damage):
+    """Write user inputs into a feature row that starts as a copy of BASELINE_ROW"""
+    # Reset categorical flags
+    row[SEASON_COLS] = 0
+    row[CROP_COLS] = 0
+    
+    # Set user-selected flags (exact match first, then case-insensitive).
+    # Values without a column, e.g. the Monsoon baseline season, keep all flags at 0.
+    season_idx = SEASON_LOOKUP.get(user_season)
+    if season_idx is None:
+        season_idx = SEASON_FALLBACK.get(user_season.lower())
+    if season_idx is not None:
+        row[season_idx] = 1
+    
+    crop_idx = CROP_LOOKUP.get(user_crop)
+    if crop_idx is None:
+        crop_idx = CROP_FALLBACK.get(user_crop.lower())
+    if crop_idx is not None:
+        row[crop_idx] = 1
+    
+    # Update numerical values
+    row[IDX_T2M] = user_temp
+    row[IDX_RF] = user_rainfall
+    row[IDX_SM] = user_moisture
+    row[IDX_PD] = user_pest_damage
+    
+    # Recalculate interaction features
+    row[IDX_PDxSM] = user_pest_damage * user_moisture
+    row[IDX_PDxTD] = user_pest_damage * TEMP_DEVIATION
+    row[IDX_PHxRF] = PEST_HOTSPOTS * user_rainfall
+
+def predict_proba(data):
+    """Class probabilities for a (rows, features) float32 matrix in one model call"""
+    # Without ONNX Runtime, inplace_predict reads the float32 matrix directly (no DMatrix)
+    if onnx_session is not None:
+        return onnx_session.run(["probabilities"], {"input": data})[0]
+    return booster.inplace_predict(data)
+
+# Warm up every serving path (probabilities, exact SHAP on CPU or GPU, approximate
+# contributions) so the first request doesn't pay one-time setup costs
+try:
+    if best_model is not None and BASELINE_ROW is not None:
+        warm = BASELINE_ROW.reshape(1, -1)
+        predict_proba(warm)
+        if USE_GPU_SHAP or shap_explainer is not None:
+            compute_shap_values(warm)
+        compute_approx_contribs(warm)
+        print("✅ Model warmed up")
+except Exception as e:
+    print(f"⚠️  Model warmup failed: {e}")
+
+def explain_rows(data, predicted_classes, explain):
+    """SHAP values of each row's predicted class, plus the method used for each row"""
+    has_shap = USE_GPU_SHAP or shap_explainer is not None
+    exact = np.asarray(explain, dtype=bool) & has_shap
+    values = np.empty(data.shape, dtype=np.float64)
+    
+    for mask, compute in ((exact, compute_shap_values), (~exact, compute_approx_contribs)):
+        if mask.any():
+            # One call for all rows that use this method
+            contribs = compute(data[mask])
+            values[mask] = contribs[predicted_classes[mask], np.arange(mask.sum())]
+    
+    return values, ['shap' if e else 'approximate' for e in exact]
+
+def format_prediction(row, proba, class_shap_values, explanation_method, top_k, scored_row=None):
+    """Build the API response for one row from its probabilities and SHAP values.
+    
+    feature_value reports the user's row; scored_row (default: row) is the
+    quantized row the probabilities and SHAP values were computed for, and is
+    reported as explanation['scored_inputs'].
+    """
+    if scored_row is None:
+        scored_row = row
+    
+    prediction_code = int(np.argmax(proba))
+    prediction_text = STRESS_MAP[prediction_code]
+    
+    # Get confidence scores
+    confidence = float(np.max(proba)) * 100
+    
+    feature_importance = []
+    if class_shap_values is not None:
+        # Keep only the top-k features by absolute SHAP value (most important first)
+        abs_shap = np.abs(class_shap_values)
+        k = min(top_k, len(X_cols)) if top_k > 0 else len(X_cols)
+        top_idx = np.argpartition(-abs_shap, k - 1)[:k]
+        top_idx = top_idx[np.argsort(-abs_shap[top_idx], kind='stable')]
+        
+        # Round once in NumPy; orjson serializes the NumPy scalars natively
+        shap_round = np.round(class_shap_values, 4)
+        feat_round = np.round(row, 2)
+        
+        # Create feature importance list
+        for idx in top_idx:
+            col_name = X_cols[idx]
+            shap_val = class_shap_values[idx]
+            # Friendly name
+            friendly_name = FRIENDLY_ARR[idx]
+            
+            feature_importance.append({
+                'feature': col_name,
+                'friendly_name': friendly_name,
+                'shap_value': shap_round[idx],
+                'feature_value': feat_round[idx],
+                'direction': 'increases' if shap_val > 0 else 'decreases',
+                'farmer_friendly': f"{friendly_name} {'increased' if shap_val > 0 else 'decreased'} stress risk by {abs(shap_val):.2%}"
+            })
+    
+    return {
+        'success': True,
+        'prediction': prediction_text,
+        'confidence': round(confidence, 2),
+        'probabilities': {
+            'Healthy': round(float(proba[0]) * 100, 2),
+            'Moderate Stress': round(float(proba[1]) * 100, 2),
+            'Severe Stress': round(float(proba[2]) * 100, 2)
+        },
+        'explanation': {
+            'method': explanation_method if class_shap_values is not None else None,
+            'feature_importance': feature_importance,
+            'top_factors': feature_importance[:3] if len(feature_importance) > 3 else feature_importance,
+            'scored_inputs': {
+                'temperature': round(float(scored_row[IDX_T2M]), 2),
+                'rainfall': round(float(scored_row[IDX_RF]), 2),
+                'soil_moisture': round(float(scored_row[IDX_SM]), 2),
+                'pest_damage': round(float(scored_row[IDX_PD]), 2)
+            }
+        }
+    }
+
+class ExplanationError(Exception):
+    """SHAP failed after the rows were scored; carries the probabilities"""
+    
+    def __init__(self, proba, cause):
+        super().__init__(str(cause))
+        self.proba = proba
+
+def score_rows(data, explain):
+    """Probabilities, predicted-class SHAP values and explanation method for each row.
+    
+    Raises ExplanationError if the explanation fails, so partial results are
+    never cached.
+    """
+    proba = predict_proba(data)
+    predicted_classes = np.argmax(proba, axis=1)
+    
+    # Generate SHAP explanation
+    try:
+        class_shap_values, methods = explain_rows(data, predicted_classes, explain)
+    except Exception as e:
+        raise ExplanationError(proba, e) from e
+    
+    return proba, class_shap_values, methods
+
+def score_rows_or_unexplained(data, explain):
+    """score_rows, falling back to probabilities without explanations if SHAP fails"""
+    try:
+        return score_rows(data, explain)
+    except ExplanationError as e:
+        print(f"⚠️  SHAP calculation failed: {e}")
+        return e.proba, [None] * len(data), [None] * len(data)
+
+def predict_rows(data, explain, top_k, display=None):
+    """Predict and explain a (rows, features) matrix; explain/top_k are per row.
+    
+    display (default: data) holds the rows whose values are reported as feature_value.
+    """
+    if display is None:
+        display = data
+    proba, class_shap_values, methods = score_rows_or_unexplained(data, explain)
+    return [
+        format_prediction(display[i], proba[i], class_shap_values[i], methods[i], top_k[i], data[i])
+        for i in range(len(data))
+    ]
+
+def build_feature_row(*inputs):
+    """Fresh feature row: the precomputed baseline with the user's inputs written in"""
+    row = BASELINE_ROW.copy()
+    fill_feature_row(row, *inputs)
+    return row
+
+@lru_cache(maxsize=PREDICTION_CACHE_SIZE)
+def _score_cached(user_season, user_crop, user_temp, user_rainfall, user_moisture, user_pest_damage, explain):
+    """Model outputs for quantized inputs; the cached arrays are shared, don't mutate them.
+    
+    An ExplanationError propagates, so a failed explanation is never cached.
+    """
+    live = build_feature_row(
+        user_season, user_crop, user_temp, user_rainfall, user_moisture, user_pest_damage
+    ).reshape(1, -1)
+    proba, class_shap_values, methods = score_rows(live, [explain])
+    return proba[0], class_shap_values[0], methods[0]
 
 @app.get('/')
 def root():
     """Root endpoint"""
     return {"message": "Crop Stress API is running"}
 
-@app.post('/api/predict')
-def predict(request_data: PredictionRequest):
-    """API endpoint for crop stress prediction with SHAP explanations"""
+def validate_request(request_data):
+    """Return an error message for out-of-range inputs, or None if they are valid"""
+    # Validate input ranges (single vectorized check on the common path)
+    values = np.array([
+        request_data.temperature,
+        request_data.rainfall,
+        request_data.soil_moisture,
+        request_data.pest_damage
+    ])
+    bad = ~((values >= VAL_LO) & (values <= VAL_HI))
+    
+    if bad.any():
+        return ' | '.join(VAL_ERRORS[i] for i in np.flatnonzero(bad))
+    return None
+
+def request_inputs(request_data):
+    """The model inputs of a request, in fill_feature_row order"""
+    return (
+        request_data.season,
+        request_data.crop_type,
+        float(request_data.temperature),
+        float(request_data.rainfall),
+        float(request_data.soil_moisture),
+        float(request_data.pest_damage)
+    )
+
+def quantize_inputs(inputs):
+    """Quantize inputs so near-identical requests share a cache entry"""
+    season, crop, temp, rainfall, moisture, pest_damage = inputs
+    return (
+        season,
+        crop,
+        round(temp * 2) / 2,
+        float(round(rainfall)),
+        float(round(moisture)),
+        float(round(pest_damage))
+    )
+
+def compute_prediction(request_data):
+    """Validate a request and run the (cached) prediction; runs on prediction_pool"""
     try:
-        # Validate input ranges
-        VALIDATION_RULES = {
-            'temperature': (-50, 60),
-            'rainfall': (0, 500),
-            'soil_moisture': (0, 100),
-            'pest_damage': (0, 100)
-        }
-        
-        validation_errors = []
-        if not (VALIDATION_RULES['temperature'][0] <= request_data.temperature <= VALIDATION_RULES['temperature'][1]):
-            validation_errors.append(f"Temperature must be between -50 and 60°C")
-        if not (VALIDATION_RULES['rainfall'][0] <= request_data.rainfall <= VALIDATION_RULES['rainfall'][1]):
-            validation_errors.append(f"Rainfall must be between 0 and 500mm")
-        if not (VALIDATION_RULES['soil_moisture'][0] <= request_data.soil_moisture <= VALIDATION_RULES['soil_moisture'][1]):
-            validation_errors.append(f"Soil Moisture must be between 0 and 100%")
-        if not (VALIDATION_RULES['pest_damage'][0] <= request_data.pest_damage <= VALIDATION_RULES['pest_damage'][1]):
-            validation_errors.append(f"Pest Damage must be between 0 and 100%")
+        validation_error = validate_request(request_data)
+        if validation_error:
+            return {'success': False, 'error': validation_error}
         
-        if validation_errors:
-            return {'success': False, 'error': ' | '.join(validation_errors)}
-        
-        if best_model is None or X_train is None or X_cols is None:
+        if best_model is None or BASELINE_ROW is None:
             return {'success': False, 'error': 'Model not loaded'}
         
-        # Create baseline with average values
-        baseline = X_train.mean().to_dict()
-        
-        # Parse user input
-        user_season = request_data.season
-        user_crop = request_data.crop_type
-        user_temp = float(request_data.temperature)
-        user_rainfall = float(request_data.rainfall)
-        user_moisture = float(request_data.soil_moisture)
-        user_pest_damage = float(request_data.pest_damage)
-        
-        # Reset categorical flags
-        for col in X_cols:
-            if "Season_" in col or "Crop_Type_" in col:
-                baseline[col] = 0
-        
-        # Set user-selected flags
-        season_col = f"Season_{user_season}"
-        crop_col = f"Crop_Type_{user_crop}"
+        inputs = request_inputs(request_data)
+        scored = quantize_inputs(inputs)
+        try:
+            proba, class_shap_values, method = _score_cached(*scored, request_data.explain)
+        except ExplanationError as e:
+            # Serve the prediction without an explanation; the next request retries SHAP
+            print(f"⚠️  SHAP calculation failed: {e}")
+            proba, class_shap_values, method = e.proba[0], None, None
         
-        if season_col in baseline:
-            baseline[season_col] = 1
-        else:
-            # If season not found, try to set it (handle case mismatch)
-            found_season = False
-            for col in X_cols:
-                if col.startswith("Season_") and col.endswith(user_season):
-                    baseline[col] = 1
-                    found_season = True
-                    break
-            if not found_season and season_col != "Season_Monsoon":
-                pass  # Season not in model
-                
-        if crop_col in baseline:
-            baseline[crop_col] = 1
-        else:
-            # If crop not found, try to set it (handle case mismatch)
-            found_crop = False
-            for col in X_cols:
-                if col.startswith("Crop_Type_") and col.endswith(user_crop):
-                    baseline[col] = 1
-                    found_crop = True
-                    break
+        # Report the user's own values alongside the quantized inputs that were scored
+        row = build_feature_row(*inputs)
+        return format_prediction(
+            row, proba, class_shap_values, method, request_data.top_k, build_feature_row(*scored)
+        )
         
-        # Update numerical values
-        baseline['T2M'] = user_temp
-        baseline['Rainfall'] = user_rainfall
-        baseline['Soil_Moisture'] = user_moisture
-        baseline['Pest_Damage'] = user_pest_damage
+    except Exception as e:
+        return {'success': False, 'error': str(e)}
+
+def compute_batch_prediction(requests):
+    """Validate a batch and predict all valid rows through one model call; runs on prediction_pool"""
+    try:
+        if len(requests) > MAX_BATCH_SIZE:
+            return {'success': False, 'error': f"Batch size must be at most {MAX_BATCH_SIZE}"}
         
-        # Recalculate interaction features
-        baseline['pest_damage_x_moisture'] = baseline['Pest_Damage'] * baseline['Soil_Moisture']
-        baseline['pest_damage_x_temp_deviation'] = baseline['Pest_Damage'] * baseline.get('temp_deviation_from_normal', 0)
-        baseline['pest_hotspots_x_rainfall'] = baseline.get('Pest_Hotspots', 0) * baseline['Rainfall']
+        if best_model is None or BASELINE_ROW is None:
+            return {'success': False, 'error': 'Model not loaded'}
         
-        # Make prediction
-        live_data = pd.DataFrame([baseline])[X_cols]
-        prediction_code = best_model.predict(live_data)[0]
-        prediction_text = STRESS_MAP[int(prediction_code)]
+        results = [None] * len(requests)
+        valid = []
+        for i, request_data in enumerate(requests):
+            validation_error = validate_request(request_data)
+            if validation_error:
+                results[i] = {'success': False, 'error': validation_error}
+            else:
+                valid.append(i)
         
-        # Get confidence scores
-        proba = best_model.predict_proba(live_data)[0]
-        confidence = float(np.max(proba)) * 100
+        if valid:
+            # Broadcast the baseline, then write each request's inputs into its row:
+            # quantized for scoring (same as /api/predict), raw for feature_value
+            data = np.repeat(BASELINE_ROW.reshape(1, -1), len(valid), axis=0)
+            display = data.copy()
+            for row, display_row, i in zip(data, display, valid):
+                inputs = request_inputs(requests[i])
+                fill_feature_row(row, *quantize_inputs(inputs))
+                fill_feature_row(display_row, *inputs)
+            
+            predictions = predict_rows(
+                data,
+                [requests[i].explain for i in valid],
+                [requests[i].top_k for i in valid],
+                display
+            )
+            for i, prediction in zip(valid, predictions):
+                results[i] = prediction
         
-        # Generate SHAP explanation
-        shap_values = None
-        feature_importance = []
-        try:
-            if shap_explainer is not None:
-                # Get SHAP values for this prediction
-                shap_vals = shap_explainer.shap_values(live_data)
-                
-                # Get the SHAP values for the predicted class
-                predicted_class = int(prediction_code)
-                class_shap_values = shap_vals[predicted_class][0]
-                
-                # Create feature importance list
-                base_value = shap_explainer.expected_value[predicted_class]
-                
-                for idx, col_name in enumerate(X_cols):
-                    shap_val = float(class_shap_values[idx])
-                    # Friendly name
-                    friendly_name = FEATURE_NAMES_FRIENDLY.get(col_name, col_name)
-                    
-                    # Get feature value
-                    feature_val = live_data[col_name].values[0]
-                    
-                    feature_importance.append({
-                        'feature': col_name,
-                        'friendly_name': friendly_name,
-                        'shap_value': round(shap_val, 4),
-                        'feature_value': round(float(feature_val), 2),
-                        'direction': 'increases' if shap_val > 0 else 'decreases',
-                        'farmer_friendly': f"{friendly_name} {'increased' if shap_val > 0 else 'decreased'} stress risk by {abs(shap_val):.2%}"
-                    })
-                
-                # Sort by absolute SHAP value (most important first)
-                feature_importance.sort(key=lambda x: abs(x['shap_value']), reverse=True)
-        except Exception as e:
-            print(f"⚠️  SHAP calculation failed: {e}")
-        
-        return {
-            'success': True,
-            'prediction': prediction_text,
-            'confidence': round(confidence, 2),
-            'probabilities': {
-                'Healthy': round(float(proba[0]) * 100, 2),
-                'Moderate Stress': round(float(proba[1]) * 100, 2),
-                'Severe Stress': round(float(proba[2]) * 100, 2)
-            },
-            'explanation': {
-                'feature_importance': feature_importance,
-                'top_factors': feature_importance[:3] if len(feature_importance) > 3 else feature_importance
-            }
-        }
+        return {'success': True, 'results': results}
         
     except Exception as e:
         return {'success': False, 'error': str(e)}
 
+@app.post('/api/predict', openapi_extra=request_body_openapi(PREDICTION_REQUEST_SCHEMA))
+async def predict(request_data: PredictionRequest = Depends(parse_prediction_request)):
+    """API endpoint for crop stress prediction with SHAP explanations"""
+    loop = asyncio.get_running_loop()
+    result = await loop.run_in_executor(prediction_pool, compute_prediction, request_data)
+    return json_response(result)
+
+@app.post(
+    '/api/predict_batch',
+    openapi_extra=request_body_openapi({'type': 'array', 'items': PREDICTION_REQUEST_SCHEMA})
+)
+async def predict_batch(requests: List[PredictionRequest] = Depends(parse_prediction_batch)):
+    """API endpoint for predicting many inputs with one model call"""
+    loop = asyncio.get_running_loop()
+    result = await loop.run_in_executor(prediction_pool, compute_batch_prediction, requests)
+    return json_response(result)
+
 @app.get('/api/health')
 def health():
     """Health check endpoint"""
     return {'status': 'ok', 'model_loaded': best_model is not None}
-
-if __name__ == '__main__':
-    print("\n" + "="*50)
-    print("🌾 Crop Stress Classification API")
-    print("="*50)
-    print(f"📍 Server running at http://localhost:8001")
-    print("="*50 + "\n")
-    import uvicorn
-    uvicorn.run(app, host='0.0.0.0', port=8001)
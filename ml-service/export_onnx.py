@@ -0,0 +1,49 @@
+"""
+Export the XGBoost crop stress model to ONNX for ONNX Runtime inference
+
+Needs the export-only dependencies: pip install -r requirements-export.txt
+"""
+
+import json
+import os
+import sys
+
+from xgboost import XGBClassifier
+from onnxmltools import convert_xgboost
+from onnxmltools.convert.common.data_types import FloatTensorType
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODELS_DIR = os.path.join(BASE_DIR, 'models')
+MODEL_PATH = os.path.join(MODELS_DIR, 'crop_stress_model.json')
+FEATURES_PATH = os.path.join(MODELS_DIR, 'feature_columns.json')
+ONNX_MODEL_PATH = os.path.join(MODELS_DIR, 'crop_stress_model.onnx')
+
+
+def export_onnx():
+    """Convert the saved model; re-run whenever crop_stress_model.json changes"""
+    with open(FEATURES_PATH, 'r') as f:
+        X_cols = json.load(f)
+    
+    model = XGBClassifier()
+    model.load_model(MODEL_PATH)
+    
+    # The converter only understands positional f0..fN feature names; the
+    # column order is the one in feature_columns.json
+    model.get_booster().feature_names = None
+    
+    onnx_model = convert_xgboost(
+        model,
+        initial_types=[("input", FloatTensorType([None, len(X_cols)]))],
+        target_opset=15
+    )
+    with open(ONNX_MODEL_PATH, 'wb') as f:
+        f.write(onnx_model.SerializeToString())
+    print(f"✅ ONNX model written to {ONNX_MODEL_PATH}")
+
+
+if __name__ == "__main__":
+    try:
+        export_onnx()
+    except Exception as e:
+        print(f"❌ ONNX export failed: {e}")
+        sys.exit(1)
@@ -0,0 +1,154 @@
+"""
+Tests for the FastAPI prediction endpoints (run with: pytest test_app.py)
+"""
+
+import os
+import sys
+
+import pytest
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import app as app_module
+
+client = TestClient(app_module.app)
+
+# Inputs on the quantization grid, so scored and reported values coincide
+SAMPLE_INPUTS = [
+    {"season": "Kharif", "crop_type": "Rice", "temperature": 30, "rainfall": 100, "soil_moisture": 40, "pest_damage": 10},
+    {"season": "Monsoon", "crop_type": "Rice", "temperature": 28, "rainfall": 300, "soil_moisture": 80, "pest_damage": 30},
+    {"season": "Summer", "crop_type": "Rice", "temperature": 35, "rainfall": 2, "soil_moisture": 20, "pest_damage": 30},
+    {"season": "Winter", "crop_type": "Wheat", "temperature": 12.5, "rainfall": 40, "soil_moisture": 60, "pest_damage": 5},
+    {"season": "Summer", "crop_type": "Wheat", "temperature": 45, "rainfall": 0, "soil_moisture": 5, "pest_damage": 90},
+]
+
+pytestmark = pytest.mark.skipif(app_module.best_model is None, reason="Model not loaded")
+
+
+def predict(payload):
+    response = client.post('/api/predict', json=payload)
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_predict_returns_probabilities_and_exact_explanation():
+    result = predict(SAMPLE_INPUTS[2])
+
+    assert result['success'] is True
+    assert result['prediction'] in app_module.STRESS_MAP.values()
+    assert sum(result['probabilities'].values()) == pytest.approx(100, abs=0.1)
+    assert result['explanation']['method'] == 'shap'
+    assert len(result['explanation']['top_factors']) == 3
+
+
+def test_invalid_range_is_reported():
+    result = predict({**SAMPLE_INPUTS[0], "temperature": 99, "rainfall": -1})
+
+    assert result == {
+        'success': False,
+        'error': "Temperature must be between -50 and 60°C | Rainfall must be between 0 and 500mm"
+    }
+
+
+def test_numeric_strings_are_coerced():
+    payload = {key: str(value) if isinstance(value, (int, float)) else value for key, value in SAMPLE_INPUTS[2].items()}
+
+    assert predict(payload)['probabilities'] == predict(SAMPLE_INPUTS[2])['probabilities']
+
+
+def test_malformed_body_returns_fastapi_422():
+    response = client.post('/api/predict', json={**SAMPLE_INPUTS[0], "temperature": "hot"})
+
+    assert response.status_code == 422
+    assert response.json()['detail'][0]['loc'] == ['body', 'temperature']
+
+
+def test_feature_value_reports_raw_input():
+    result = predict({**SAMPLE_INPUTS[3], "temperature": 12.3, "soil_moisture": 22.2, "top_k": 0})
+    values = {f['feature']: f['feature_value'] for f in result['explanation']['feature_importance']}
+
+    assert values['T2M'] == pytest.approx(12.3)
+    assert values['Soil_Moisture'] == pytest.approx(22.2)
+
+
+def test_scored_inputs_report_the_quantized_row():
+    result = predict({**SAMPLE_INPUTS[0], "temperature": 30.2, "rainfall": 101.3, "soil_moisture": 40.4, "pest_damage": 10.2})
+
+    assert result['explanation']['scored_inputs'] == {
+        'temperature': 30.0, 'rainfall': 101.0, 'soil_moisture': 40.0, 'pest_damage': 10.0
+    }
+    assert predict(SAMPLE_INPUTS[0])['explanation']['scored_inputs'] == {
+        key: float(SAMPLE_INPUTS[0][key]) for key in ('temperature', 'rainfall', 'soil_moisture', 'pest_damage')
+    }
+
+
+def test_top_k_limits_feature_importance():
+    assert len(predict({**SAMPLE_INPUTS[0], "top_k": 1})['explanation']['feature_importance']) == 1
+    assert len(predict({**SAMPLE_INPUTS[0], "top_k": 0})['explanation']['feature_importance']) == len(app_module.X_cols)
+
+
+def test_season_and_crop_match_case_insensitively():
+    lower = predict({**SAMPLE_INPUTS[3], "season": "winter", "crop_type": "wheat"})
+
+    assert lower == predict(SAMPLE_INPUTS[3])
+
+
+@pytest.mark.parametrize("payload", SAMPLE_INPUTS)
+def test_approximate_attributions_agree_in_direction_with_shap(payload):
+    exact = predict({**payload, "explain": True})['explanation']
+    approx = predict({**payload, "explain": False, "top_k": 0})['explanation']
+    approx_direction = {f['feature']: f['direction'] for f in approx['feature_importance']}
+
+    assert exact['method'] == 'shap'
+    assert approx['method'] == 'approximate'
+    for factor in exact['top_factors']:
+        assert approx_direction[factor['feature']] == factor['direction'], factor['feature']
+
+
+def test_batch_matches_single_predictions():
+    batch = SAMPLE_INPUTS + [
+        {**SAMPLE_INPUTS[0], "pest_damage": 150},
+        {**SAMPLE_INPUTS[1], "explain": False, "top_k": 5},
+        # Off the quantization grid: both endpoints must score the quantized row
+        {"season": "Summer", "crop_type": "Rice", "temperature": 30.2, "rainfall": 101.3, "soil_moisture": 40.4, "pest_damage": 10.2},
+    ]
+    response = client.post('/api/predict_batch', json=batch)
+
+    assert response.status_code == 200
+    result = response.json()
+    assert result['success'] is True
+    assert result['results'] == [predict(payload) for payload in batch]
+    assert result['results'][len(SAMPLE_INPUTS)]['success'] is False
+
+
+def test_batch_rejects_oversized_batch(monkeypatch):
+    monkeypatch.setattr(app_module, 'MAX_BATCH_SIZE', 2)
+    result = client.post('/api/predict_batch', json=SAMPLE_INPUTS[:3]).json()
+
+    assert result == {'success': False, 'error': "Batch size must be at most 2"}
+
+
+def test_batch_rejects_non_list_body():
+    assert client.post('/api/predict_batch', json=SAMPLE_INPUTS[0]).status_code == 422
+
+
+def test_failed_explanation_is_not_cached(monkeypatch):
+    payload = {**SAMPLE_INPUTS[0], "temperature": 31}
+    app_module._score_cached.cache_clear()
+    real_explain_rows = app_module.explain_rows
+
+    def failing_explain_rows(*args):
+        raise RuntimeError("transient SHAP failure")
+
+    monkeypatch.setattr(app_module, 'explain_rows', failing_explain_rows)
+    failed = predict(payload)
+    assert failed['success'] is True
+    assert failed['explanation']['method'] is None
+    assert failed['explanation']['feature_importance'] == []
+
+    monkeypatch.setattr(app_module, 'explain_rows', real_explain_rows)
+    for temperature in (31, 31.1):
+        explanation = predict({**payload, "temperature": temperature})['explanation']
+        assert explanation['method'] == 'shap'
+        assert explanation['feature_importance']